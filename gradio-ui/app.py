@@ -1,43 +1,73 @@
 import os
+import json
+import atexit
 import httpx
 import gradio as gr
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://nginx:8088")
 EDGE_API_KEY = os.getenv("EDGE_API_KEY", "")
 
-def call_api(path: str, payload: dict):
-    if not EDGE_API_KEY:
-        return {"error": "EDGE_API_KEY is not set for the UI container."}
-    headers = {"X-API-Key": EDGE_API_KEY}
-    with httpx.Client(timeout=120) as client:
-        r = client.post(f"{API_BASE_URL}{path}", json=payload, headers=headers)
+# One client for the life of the UI: keeps the connection to NGINX alive
+# between chat turns instead of reconnecting on every call. HTTP/2 is used
+# when the API is served over TLS; plain http:// stays on HTTP/1.1.
+CLIENT = httpx.Client(
+    base_url=API_BASE_URL,
+    headers={"X-API-Key": EDGE_API_KEY},
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+    timeout=httpx.Timeout(120.0, connect=2.0),
+)
+atexit.register(CLIENT.close)
+
+def stream_api(path: str, payload: dict):
+    """POST to an SSE endpoint and yield (event, data) pairs as they arrive."""
+    with CLIENT.stream("POST", path, json=payload, headers={"Accept": "text/event-stream"}) as r:
         r.raise_for_status()
-        return r.json()
+        event, data = "message", []
+        for line in r.iter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data.append(line[len("data:"):].strip())
+            elif line == "" and data:
+                yield event, json.loads("\n".join(data))
+                event, data = "message", []
+
+def format_sources(sources: list) -> str:
+    if not sources:
+        return ""
+    out = "\n\n---\n**Sources (retrieved from Weaviate):**\n"
+    for i, s in enumerate(sources, start=1):
+        title = s.get("title") or "Untitled"
+        url = s.get("url") or ""
+        dist = s.get("distance")
+        out += f"{i}. {title} — {url} (distance={dist})\n"
+    return out
 
 def chat_fn(message, history):
-    data = call_api("/chat", {"message": message})
-    if "error" in data:
-        return f"Error: {data['error']}"
-    answer = (data.get("answer") or "").strip()
-    sources = data.get("sources") or []
-
-    if sources:
-        answer += "\n\n---\n**Sources (retrieved from Weaviate):**\n"
-        for i, s in enumerate(sources, start=1):
-            title = s.get("title") or "Untitled"
-            url = s.get("url") or ""
-            dist = s.get("distance")
-            answer += f"{i}. {title} — {url} (distance={dist})\n"
-    return answer
+    """Stream the answer token-by-token; sources are appended once it finishes."""
+    if not EDGE_API_KEY:
+        yield "Error: EDGE_API_KEY is not set for the UI container."
+        return
+    answer = ""
+    sources = []
+    for event, data in stream_api("/chat/stream", {"message": message}):
+        if event == "sources":
+            sources = data or []
+        elif event == "token":
+            answer += data
+            yield answer
+        elif event == "error":
+            yield f"{answer}\n\nError: {data.get('detail')}"
+            return
+    yield answer.strip() + format_sources(sources)
 
 def health_text():
     if not EDGE_API_KEY:
         return "UI misconfigured: EDGE_API_KEY is missing."
-    headers = {"X-API-Key": EDGE_API_KEY}
     try:
-        with httpx.Client(timeout=10) as client:
-            r = client.get(f"{API_BASE_URL}/health", headers=headers)
-            return f"{r.status_code}: {r.text}"
+        r = CLIENT.get("/health", timeout=10)
+        return f"{r.status_code}: {r.text}"
     except Exception as e:
         return f"Health check failed: {e}"
 
@@ -0,0 +1,159 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+
+def _unit(vec: List[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+class TTLCache:
+    """
+    Small LRU keyed by exact value, with optional expiry.
+
+    Entries older than ttl_s (if set) are treated as misses, and the least
+    recently used entry is evicted past max_size. max_size=0 disables it.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_s: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_s is not None and time.monotonic() - entry[0] > self.ttl_s:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Any, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class SemanticCache:
+    """
+    In-process cache of (query embedding -> answer, sources).
+
+    A lookup returns the most similar cached entry if its cosine similarity
+    is >= tau, so rephrased versions of the same question skip retrieval and
+    generation. Entries expire after ttl_s and the oldest are evicted past
+    max_size (LRU). max_size=0 disables the cache.
+
+    Unit vectors live in one preallocated (max_size, dim) float32 matrix, so
+    a lookup is a single matrix-vector product (tens of microseconds at the
+    default size) rather than a Python loop over every entry. Rows are
+    reused as slots; _entries maps slot -> (answer, sources) in LRU order.
+
+    invalidate() bumps a generation counter; put() drops answers computed
+    against an older generation so an ingest that lands mid-request can't
+    leave a stale answer behind.
+    """
+
+    def __init__(self, max_size: int = 256, ttl_s: float = 600.0, tau: float = 0.92):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.tau = tau
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        size = max(max_size, 0)
+        self._vecs: Optional[np.ndarray] = None  # allocated on first put, once dim is known
+        self._ts = np.zeros(size)
+        self._live = np.zeros(size, dtype=bool)
+        self._entries: "OrderedDict[int, Tuple[str, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _drop(self, slot: int) -> None:
+        self._live[slot] = False
+        self._entries.pop(slot, None)
+
+    def lookup(self, vec: List[float]) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        if not self.enabled:
+            return None
+        q = _unit(vec)
+        now = time.monotonic()
+        with self._lock:
+            if self._vecs is None or q.shape[0] != self._vecs.shape[1]:
+                self.misses += 1
+                return None
+
+            for slot in np.flatnonzero(self._live & (now - self._ts > self.ttl_s)):
+                self._drop(int(slot))
+
+            sims = self._vecs @ q
+            sims[~self._live] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < self.tau:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best]
+
+    def put(self, vec: List[float], answer: str, sources: List[Dict[str, Any]], generation: int) -> None:
+        if not self.enabled:
+            return
+        v = _unit(vec)
+        with self._lock:
+            if generation != self.generation:
+                return
+            if self._vecs is None or self._vecs.shape[1] != v.shape[0]:
+                self._vecs = np.zeros((self.max_size, v.shape[0]), dtype=np.float32)
+                self._live[:] = False
+                self._entries.clear()
+            if len(self._entries) >= self.max_size:
+                slot, _ = self._entries.popitem(last=False)
+                self._live[slot] = False
+
+            slot = int(np.argmin(self._live))  # first free row
+            self._vecs[slot] = v
+            self._ts[slot] = time.monotonic()
+            self._live[slot] = True
+            self._entries[slot] = (answer, sources)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._live[:] = False
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "generation": self.generation,
+        }
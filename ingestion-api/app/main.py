@@ -1,15 +1,26 @@
 import os
+import hmac
+import hashlib
 import time
 import uuid
 import asyncio
 import logging
+from typing import List
 
-from fastapi import FastAPI, HTTPException, Request, Query
-from fastapi.responses import PlainTextResponse
+import httpx
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Query, Security
+from fastapi.security import APIKeyHeader
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from prometheus_client import Counter, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
 
 from .schemas import ArticleIn, ChatIn
-from .weaviate_client import ready, ensure_schema, insert_doc
-from .rag import retrieve_sources, build_prompt, ollama_generate
+from .weaviate_client import ready, ensure_schema, insert_doc, insert_docs
+from .weaviate_client import aclose as close_weaviate_client
+from .rag import retrieve_sources, build_prompt, ollama_generate, ollama_stream, aclose as close_rag_clients
+from .rag import embed_query, embed_cache_stats, pack_sources, SEMANTIC_CACHE
+from .rag import clear_retrieve_cache, retrieve_cache_stats, llm_cache_stats
+from .cache import TTLCache
 from .security_memory.router import router as memory_router
 
 
@@ -24,23 +35,50 @@ logger = logging.getLogger("ingestion-api")
 # Config
 # -----------------------------
 EDGE_API_KEY = os.getenv("EDGE_API_KEY", "")
+_EDGE_API_KEY_B = EDGE_API_KEY.encode()
 
-RETRIEVE_TIMEOUT_S = float(os.getenv("RETRIEVE_TIMEOUT_S", "10"))
-PROMPT_TIMEOUT_S = float(os.getenv("PROMPT_TIMEOUT_S", "5"))
-OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT_S", "120"))
+# Per-stage limits (connect/read/write/pool) live on the httpx clients in rag.py;
+# this is only the outer guard for a whole chat.
 CHAT_TOTAL_TIMEOUT_S = float(os.getenv("CHAT_TOTAL_TIMEOUT_S", "180"))
 
 
 # -----------------------------
 # App + counters
 # -----------------------------
-app = FastAPI(title="Lab 2 Ingestion + RAG API")
+app = FastAPI(title="Lab 2 Ingestion + RAG API", default_response_class=ORJSONResponse)
 app.include_router(memory_router)
 
 START = time.time()
-INGEST_COUNT = 0
-CHAT_COUNT = 0
-ERROR_COUNT = 0
+INGESTED = Counter("ingestion_api_ingested", "Documents ingested into Weaviate.")
+CHATS = Counter("ingestion_api_chats", "Chat requests answered.")
+ERRORS = Counter("ingestion_api_errors", "Requests that failed.")
+
+
+# Short-lived cache for the readiness probe that monitors and the UI poll.
+_HEALTH_CACHE = TTLCache(max_size=1, ttl_s=float(os.getenv("HEALTH_CACHE_TTL_S", "2")))
+
+
+# Bumped on every ingest; part of the /chat ETag so clients revalidate
+# once the corpus changes.
+CORPUS_VERSION = 0
+
+
+def _corpus_changed() -> None:
+    """New content can change retrieval and answers, so drop cached ones."""
+    global CORPUS_VERSION
+    CORPUS_VERSION += 1
+    SEMANTIC_CACHE.invalidate()
+    clear_retrieve_cache()
+
+
+def _count(name: str) -> int:
+    return int(REGISTRY.get_sample_value(f"{name}_total") or 0)
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await close_rag_clients()
+    await close_weaviate_client()
 
 
 # -----------------------------
@@ -48,20 +86,30 @@ ERROR_COUNT = 0
 # -----------------------------
 @app.middleware("http")
 async def add_request_id(request: Request, call_next):
-    request.state.request_id = request.headers.get("X-Request-Id", str(uuid.uuid4()))
+    # `or` rather than a .get() default, so a uuid is only generated when needed.
+    request.state.request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex
     return await call_next(request)
 
 
+def _request_id(request: Request) -> str:
+    """The id set by add_request_id (handlers always run behind it)."""
+    return getattr(request.state, "request_id", None) or "-"
+
+
 # -----------------------------
 # Auth helper
 # -----------------------------
-def require_api_key(request: Request):
+_api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+
+def require_api_key(incoming: str = Security(_api_key_header)):
+    """Route dependency: reject requests without the edge API key."""
     if not EDGE_API_KEY:
         raise HTTPException(status_code=500, detail="EDGE_API_KEY is not set on the server.")
-    incoming = request.headers.get("X-API-Key", "")
     if not incoming:
         raise HTTPException(status_code=401, detail="Missing X-API-Key header.")
-    if incoming != EDGE_API_KEY:
+    # Constant-time compare so response timing doesn't leak how much of the key matched.
+    if not hmac.compare_digest(incoming.encode(), _EDGE_API_KEY_B):
         raise HTTPException(status_code=403, detail="Invalid API key.")
 
 
@@ -70,175 +118,370 @@ def require_api_key(request: Request):
 # -----------------------------
 @app.get("/health")
 async def health():
-    w_ok = await ready()
+    w_ok = _HEALTH_CACHE.get("weaviate")
+    if w_ok is None:
+        w_ok = await ready()
+        _HEALTH_CACHE.put("weaviate", w_ok)
     return {
         "ok": bool(w_ok),
         "uptime_s": int(time.time() - START),
-        "ingested": INGEST_COUNT,
-        "chats": CHAT_COUNT,
-        "errors": ERROR_COUNT,
+        "ingested": _count("ingestion_api_ingested"),
+        "chats": _count("ingestion_api_chats"),
+        "errors": _count("ingestion_api_errors"),
+        "semantic_cache": SEMANTIC_CACHE.stats(),
+        "embed_cache": embed_cache_stats(),
+        "retrieve_cache": retrieve_cache_stats(),
+        "llm_cache": llm_cache_stats(),
     }
 
 
-@app.get("/metrics", response_class=PlainTextResponse)
+@app.get("/metrics")
 def metrics():
-    return (
-        f"ingestion_api_ingested_total {INGEST_COUNT}\n"
-        f"ingestion_api_chats_total {CHAT_COUNT}\n"
-        f"ingestion_api_errors_total {ERROR_COUNT}\n"
-    )
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 
 # -----------------------------
 # Ingest
 # -----------------------------
-@app.post("/ingest")
+@app.post("/ingest", dependencies=[Security(require_api_key)])
 async def ingest(article: ArticleIn, request: Request):
     """Validate and ingest a document into Weaviate."""
-    global INGEST_COUNT, ERROR_COUNT
-    require_api_key(request)
-    rid = getattr(request.state, "request_id", str(uuid.uuid4()))
+    rid = _request_id(request)
 
     try:
         await asyncio.wait_for(ensure_schema(), timeout=15)
         doc = article.model_dump(mode="json")
         res = await asyncio.wait_for(insert_doc(doc), timeout=20)
-        INGEST_COUNT += 1
+        INGESTED.inc()
+        _corpus_changed()
         return {"status": "ok", "weaviate": res}
 
     except asyncio.TimeoutError:
-        ERROR_COUNT += 1
-        logger.error(f"[{rid}] /ingest: TIMEOUT")
+        ERRORS.inc()
+        logger.error("[%s] /ingest: TIMEOUT", rid)
         raise HTTPException(status_code=504, detail="Ingest timed out.")
     except Exception as e:
-        ERROR_COUNT += 1
-        logger.exception(f"[{rid}] /ingest: ERROR {type(e).__name__}: {e}")
+        ERRORS.inc()
+        logger.exception("[%s] /ingest: ERROR %s: %s", rid, type(e).__name__, e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/ingest/batch", dependencies=[Security(require_api_key)])
+async def ingest_batch(articles: List[ArticleIn], request: Request):
+    """Validate and ingest many documents using Weaviate's batch import."""
+    rid = _request_id(request)
+
+    try:
+        await asyncio.wait_for(ensure_schema(), timeout=15)
+        docs = [a.model_dump(mode="json") for a in articles]
+        res = await asyncio.wait_for(insert_docs(docs), timeout=120)
+        INGESTED.inc(res["inserted"])
+        if res["inserted"]:
+            _corpus_changed()
+        if res["failed"]:
+            ERRORS.inc(res["failed"])
+            logger.warning("[%s] /ingest/batch: %d of %d objects failed", rid, res["failed"], len(docs))
+        return {"status": "ok" if not res["failed"] else "partial", **res}
+
+    except asyncio.TimeoutError:
+        ERRORS.inc()
+        logger.error("[%s] /ingest/batch: TIMEOUT", rid)
+        raise HTTPException(status_code=504, detail="Batch ingest timed out.")
+    except Exception as e:
+        ERRORS.inc()
+        logger.exception("[%s] /ingest/batch: ERROR %s: %s", rid, type(e).__name__, e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # -----------------------------
 # Core chat implementation
 # -----------------------------
-async def _chat_impl(message: str, rid: str):
-    t0 = time.time()
+async def _semantic_cache_lookup(message: str, rid: str):
+    """
+    Embed the question and check the semantic cache.
+    Returns (query_vector, hit); both are None if the cache is off or embedding fails.
+    """
+    if not SEMANTIC_CACHE.enabled:
+        return None, None
+    try:
+        q_vec = await embed_query(message)
+    except Exception as e:
+        logger.warning("[%s] semantic cache: embed failed, skipping cache (%s: %s)", rid, type(e).__name__, e)
+        return None, None
+    return q_vec, SEMANTIC_CACHE.lookup(q_vec)
+
+
+def _ms_since(t0: int) -> int:
+    return (time.monotonic_ns() - t0) // 1_000_000
+
+
+async def _prepare_chat(message: str, rid: str, timings: dict) -> dict:
+    """
+    Everything before generation, shared by /chat and /chat/stream so the
+    pipeline is extended in one place: semantic cache, retrieve, pack, prompt.
+    Returns a dict with "answer" set when there is nothing to generate (cache
+    hit), otherwise one with the "prompt" to send to Ollama.
+    """
+    # 0) Semantic cache
+    generation = SEMANTIC_CACHE.generation
+    t = time.monotonic_ns()
+    q_vec, hit = await _semantic_cache_lookup(message, rid)
+    timings["embed"] = _ms_since(t)
+    if hit:
+        answer, sources = hit
+        return {"answer": answer, "sources": sources, "_cache": "hit"}
 
     # 1) Retrieve
-    t_retr0 = time.time()
-    sources = await asyncio.wait_for(retrieve_sources(message), timeout=RETRIEVE_TIMEOUT_S)
-    t_retr = (time.time() - t_retr0) * 1000
+    t = time.monotonic_ns()
+    retr_timings = {}
+    sources = await retrieve_sources(message, vector=q_vec, timings=retr_timings)
+    sources, tokens_left = pack_sources(sources)
+    timings["retrieve"] = _ms_since(t)
+    # dense and bm25 run concurrently; "retrieve" tracks the slower one
+    timings.update({f"retrieve_{name}": ms for name, ms in retr_timings.items()})
 
     # 2) Prompt
-    t_pr0 = time.time()
-    prompt = await asyncio.wait_for(
-        asyncio.to_thread(build_prompt, message, sources),
-        timeout=PROMPT_TIMEOUT_S,
-    )
-    t_pr = (time.time() - t_pr0) * 1000
+    t = time.monotonic_ns()
+    prompt = build_prompt(message, sources)
+    timings["prompt"] = _ms_since(t)
+
+    return {
+        "prompt": prompt,
+        "sources": sources,
+        "q_vec": q_vec,
+        "generation": generation,
+        "_debug": {
+            "context_tokens_left": tokens_left,
+            "retrieve_critical_path": max(retr_timings, key=retr_timings.get) if retr_timings else None,
+        },
+    }
+
+
+def _remember_answer(ctx: dict, answer: str) -> None:
+    """Store a freshly generated answer in the semantic cache."""
+    if ctx["q_vec"] is not None:
+        SEMANTIC_CACHE.put(ctx["q_vec"], answer, ctx["sources"], ctx["generation"])
+
+
+async def _chat_impl(message: str, rid: str):
+    t0 = time.monotonic_ns()
+    timings = {}
+
+    ctx = await _prepare_chat(message, rid, timings)
+    if "answer" in ctx:
+        timings["total"] = _ms_since(t0)
+        logger.info("[%s] chat complete (no generation) %s", rid, timings, extra={"rid": rid, **timings})
+        return {**ctx, "_timing_ms": timings}
+    prompt, sources = ctx["prompt"], ctx["sources"]
 
     # 3) Generate
-    t_llm0 = time.time()
-    answer = await asyncio.wait_for(ollama_generate(prompt), timeout=OLLAMA_TIMEOUT_S)
-    t_llm = (time.time() - t_llm0) * 1000
+    t = time.monotonic_ns()
+    answer = await ollama_generate(prompt)
+    timings["generate"] = _ms_since(t)
 
-    total = (time.time() - t0) * 1000
+    timings["total"] = _ms_since(t0)
+    logger.info("[%s] chat complete %s", rid, timings, extra={"rid": rid, **timings})
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "[%s] chat: sources=%d prompt_chars=%d answer_chars=%d",
+            rid, len(sources), len(prompt), len(answer or ""),
+        )
+
+    _remember_answer(ctx, answer)
 
     return {
         "answer": answer,
         "sources": sources,
-        "_timing_ms": {
-            "retrieve": round(t_retr, 1),
-            "prompt": round(t_pr, 1),
-            "generate": round(t_llm, 1),
-            "total": round(total, 1),
-        },
+        "_timing_ms": timings,
         "_prompt_chars": len(prompt),
+        "_debug": ctx["_debug"],
+        "_cache": "miss",
     }
 
 
 # -----------------------------
 # Chat
 # -----------------------------
-@app.post("/chat")
-async def chat(payload: ChatIn, request: Request):
-    """RAG endpoint: retrieve sources -> build prompt -> generate via Ollama."""
-    global CHAT_COUNT, ERROR_COUNT
-    require_api_key(request)
-    rid = getattr(request.state, "request_id", str(uuid.uuid4()))
+def _chat_etag(message: str) -> str:
+    # START distinguishes process lifetimes, since CORPUS_VERSION restarts at 0.
+    digest = hashlib.sha256(f"{START}:{CORPUS_VERSION}:{message}".encode()).hexdigest()[:16]
+    return f'"{digest}"'
+
+
+@app.post("/chat", dependencies=[Security(require_api_key)])
+async def chat(payload: ChatIn, request: Request, response: Response):
+    """
+    RAG endpoint: retrieve sources -> build prompt -> generate via Ollama.
+    Responses carry an ETag of (corpus version, question); a client that sends
+    it back in If-None-Match gets 304 and can reuse its previous answer.
+    """
+    rid = _request_id(request)
+
+    etag = _chat_etag(payload.message)
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
 
     try:
         result = await asyncio.wait_for(_chat_impl(payload.message, rid), timeout=CHAT_TOTAL_TIMEOUT_S)
-        CHAT_COUNT += 1
+        CHATS.inc()
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, max-age=30"
         return {"answer": result["answer"], "sources": result["sources"]}
 
     except asyncio.TimeoutError:
-        ERROR_COUNT += 1
-        logger.error(f"[{rid}] /chat: TOTAL TIMEOUT after {CHAT_TOTAL_TIMEOUT_S}s")
+        ERRORS.inc()
+        logger.error("[%s] /chat: TOTAL TIMEOUT after %.0fs", rid, CHAT_TOTAL_TIMEOUT_S)
+        raise HTTPException(status_code=504, detail="Chat timed out.")
+    except httpx.TimeoutException as e:
+        ERRORS.inc()
+        logger.error("[%s] /chat: UPSTREAM TIMEOUT (%s)", rid, type(e).__name__)
+        raise HTTPException(status_code=504, detail="Chat timed out.")
+    except Exception as e:
+        ERRORS.inc()
+        logger.exception("[%s] /chat: ERROR %s: %s", rid, type(e).__name__, e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse(event: str, data) -> str:
+    """Format one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+@app.post("/chat/stream", dependencies=[Security(require_api_key)])
+async def chat_stream(payload: ChatIn, request: Request):
+    """
+    Streaming RAG endpoint (Server-Sent Events).
+    Emits one "sources" event, then a "token" event per generated fragment,
+    then "done" (or "error" if generation fails mid-stream).
+    """
+    rid = _request_id(request)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHAT_TOTAL_TIMEOUT_S
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    # Everything up to the prompt happens before the response starts, so
+    # failures here still surface as normal HTTP errors.
+    try:
+        ctx = await asyncio.wait_for(_prepare_chat(payload.message, rid, {}), timeout=CHAT_TOTAL_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        ERRORS.inc()
+        logger.error("[%s] /chat/stream: TOTAL TIMEOUT after %.0fs", rid, CHAT_TOTAL_TIMEOUT_S)
+        raise HTTPException(status_code=504, detail="Chat timed out.")
+    except httpx.TimeoutException as e:
+        ERRORS.inc()
+        logger.error("[%s] /chat/stream: UPSTREAM TIMEOUT before generation (%s)", rid, type(e).__name__)
         raise HTTPException(status_code=504, detail="Chat timed out.")
     except Exception as e:
-        ERROR_COUNT += 1
-        logger.exception(f"[{rid}] /chat: ERROR {type(e).__name__}: {e}")
+        ERRORS.inc()
+        logger.exception("[%s] /chat/stream: ERROR %s: %s", rid, type(e).__name__, e)
         raise HTTPException(status_code=500, detail=str(e))
 
+    if "answer" in ctx:
+        async def answered_events():
+            yield _sse("sources", ctx["sources"])
+            yield _sse("token", ctx["answer"])
+            CHATS.inc()
+            yield _sse("done", {"cache": ctx.get("_cache")})
+
+        return StreamingResponse(answered_events(), media_type="text/event-stream", headers=headers)
+
+    async def events():
+        yield _sse("sources", ctx["sources"])
+        parts = []
+        tokens = ollama_stream(ctx["prompt"])
+        try:
+            while True:
+                # Same overall budget as /chat, checked per token so a stalled
+                # generation can't hold the stream open indefinitely.
+                try:
+                    token = await asyncio.wait_for(anext(tokens), timeout=max(deadline - loop.time(), 0))
+                except StopAsyncIteration:
+                    break
+                parts.append(token)
+                yield _sse("token", token)
+        except asyncio.TimeoutError:
+            ERRORS.inc()
+            logger.error("[%s] /chat/stream: TOTAL TIMEOUT after %.0fs", rid, CHAT_TOTAL_TIMEOUT_S)
+            yield _sse("error", {"detail": "Chat timed out."})
+            return
+        except Exception as e:
+            ERRORS.inc()
+            logger.exception("[%s] /chat/stream: ERROR %s: %s", rid, type(e).__name__, e)
+            yield _sse("error", {"detail": str(e)})
+            return
+        finally:
+            await tokens.aclose()
+        CHATS.inc()
+        _remember_answer(ctx, "".join(parts).strip())
+        yield _sse("done", {"cache": "miss"})
+
+    # X-Accel-Buffering tells NGINX to pass events through as they arrive.
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
 
 # -----------------------------
 # Debug endpoints
 # -----------------------------
-@app.get("/debug/retrieve")
+@app.get("/debug/retrieve", dependencies=[Security(require_api_key)])
 async def debug_retrieve(request: Request, q: str = Query(min_length=2, max_length=2000)):
-    require_api_key(request)
-    rid = getattr(request.state, "request_id", str(uuid.uuid4()))
+    rid = _request_id(request)
     try:
-        sources = await asyncio.wait_for(retrieve_sources(q), timeout=RETRIEVE_TIMEOUT_S)
+        sources = await retrieve_sources(q)
         return {"query": q, "sources": sources}
-    except asyncio.TimeoutError:
-        logger.error(f"[{rid}] /debug/retrieve: TIMEOUT")
+    except httpx.TimeoutException as e:
+        logger.error("[%s] /debug/retrieve: TIMEOUT (%s)", rid, type(e).__name__)
         raise HTTPException(status_code=504, detail="Retrieve timed out.")
     except Exception as e:
-        logger.exception(f"[{rid}] /debug/retrieve: ERROR {type(e).__name__}: {e}")
+        logger.exception("[%s] /debug/retrieve: ERROR %s: %s", rid, type(e).__name__, e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/debug/prompt")
+@app.post("/debug/prompt", dependencies=[Security(require_api_key)])
 async def debug_prompt(payload: ChatIn, request: Request):
-    require_api_key(request)
-    rid = getattr(request.state, "request_id", str(uuid.uuid4()))
+    rid = _request_id(request)
     try:
-        sources = await asyncio.wait_for(retrieve_sources(payload.message), timeout=RETRIEVE_TIMEOUT_S)
-        prompt = await asyncio.wait_for(
-            asyncio.to_thread(build_prompt, payload.message, sources),
-            timeout=PROMPT_TIMEOUT_S,
-        )
-        return {"prompt": prompt, "sources": sources, "prompt_chars": len(prompt)}
-    except asyncio.TimeoutError:
-        logger.error(f"[{rid}] /debug/prompt: TIMEOUT")
-        raise HTTPException(status_code=504, detail="Prompt build timed out.")
+        sources = await retrieve_sources(payload.message)
+        sources, tokens_left = pack_sources(sources)
+        prompt = build_prompt(payload.message, sources)
+        return {
+            "prompt": prompt,
+            "sources": sources,
+            "prompt_chars": len(prompt),
+            "context_tokens_left": tokens_left,
+        }
+    except httpx.TimeoutException as e:
+        logger.error("[%s] /debug/prompt: TIMEOUT (%s)", rid, type(e).__name__)
+        raise HTTPException(status_code=504, detail="Retrieve timed out.")
     except Exception as e:
-        logger.exception(f"[{rid}] /debug/prompt: ERROR {type(e).__name__}: {e}")
+        logger.exception("[%s] /debug/prompt: ERROR %s: %s", rid, type(e).__name__, e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/debug/chat")
+@app.post("/debug/chat", dependencies=[Security(require_api_key)])
 async def debug_chat(payload: ChatIn, request: Request):
     """Run full RAG and include timing/prompt size to identify where it hangs."""
-    require_api_key(request)
-    rid = getattr(request.state, "request_id", str(uuid.uuid4()))
+    rid = _request_id(request)
     try:
         result = await asyncio.wait_for(_chat_impl(payload.message, rid), timeout=CHAT_TOTAL_TIMEOUT_S)
         return result
     except asyncio.TimeoutError:
-        logger.error(f"[{rid}] /debug/chat: TOTAL TIMEOUT after {CHAT_TOTAL_TIMEOUT_S}s")
+        logger.error("[%s] /debug/chat: TOTAL TIMEOUT after %.0fs", rid, CHAT_TOTAL_TIMEOUT_S)
+        raise HTTPException(status_code=504, detail="debug/chat timed out.")
+    except httpx.TimeoutException as e:
+        logger.error("[%s] /debug/chat: UPSTREAM TIMEOUT (%s)", rid, type(e).__name__)
         raise HTTPException(status_code=504, detail="debug/chat timed out.")
     except Exception as e:
-        logger.exception(f"[{rid}] /debug/chat: ERROR {type(e).__name__}: {e}")
+        logger.exception("[%s] /debug/chat: ERROR %s: %s", rid, type(e).__name__, e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/debug/ollama")
-async def debug_ollama(payload: ChatIn, request: Request):
+@app.post("/debug/ollama", dependencies=[Security(require_api_key)])
+async def debug_ollama(payload: ChatIn):
     """Bypass retrieval and just test generation."""
-    require_api_key(request)
     try:
-        answer = await asyncio.wait_for(ollama_generate(payload.message), timeout=OLLAMA_TIMEOUT_S)
+        answer = await ollama_generate(payload.message)
         return {
             "ok": True,
             "ollama_base_url": os.getenv("OLLAMA_BASE_URL", ""),
@@ -1,158 +1,439 @@
 import os
+import math
+import time
+import asyncio
+import bisect
+import hashlib
+from datetime import datetime, timezone
 import httpx
-from typing import Optional, List, Dict, Any
+import orjson
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+
+from .cache import SemanticCache, TTLCache
+from .weaviate_client import ensure_schema, client as _WV
 
 # -----------------------------
-# Weaviate config
+# Shared HTTP clients
 # -----------------------------
-WEAVIATE_SCHEME = os.getenv("WEAVIATE_SCHEME", "http")
-WEAVIATE_HOST = os.getenv("WEAVIATE_HOST", "weaviate")
-WEAVIATE_PORT = os.getenv("WEAVIATE_PORT", "8080")
-WEAVIATE_BASE = f"{WEAVIATE_SCHEME}://{WEAVIATE_HOST}:{WEAVIATE_PORT}"
-
-WEAVIATE_API_KEY = os.getenv("WEAVIATE_API_KEY", "")
-
-def _headers() -> dict:
-    """
-    If Weaviate auth is enabled in your deployment, set WEAVIATE_API_KEY.
-    In your lab config it may be blank (which is fine).
-    """
-    if WEAVIATE_API_KEY:
-        return {"Authorization": f"Bearer {WEAVIATE_API_KEY}"}
-    return {}
+# One pooled client per upstream, created at import and reused by every request
+# so /chat doesn't pay a fresh TCP handshake to Weaviate and Ollama each time.
+# Weaviate's client (with its auth headers) is owned by weaviate_client.py;
+# the others are closed from the FastAPI shutdown hook via aclose().
+_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0)
 
-async def ensure_schema() -> None:
-    """
-    Ensure the LabDoc class exists.
-    Safe to call repeatedly.
-    """
-    schema = {
-        "class": "LabDoc",
-        "vectorizer": "text2vec-transformers",
-        "properties": [
-            {"name": "title", "dataType": ["text"]},
-            {"name": "url", "dataType": ["text"]},
-            {"name": "source", "dataType": ["text"]},
-            {"name": "published_date", "dataType": ["text"]},
-            {"name": "text", "dataType": ["text"]},
-        ],
-    }
+# Timeouts are per stage so a dead host or exhausted pool fails in about a
+# second instead of burning the whole read budget. The read timeout applies
+# per chunk received, which also suits streamed generation.
+WEAVIATE_TIMEOUT_S = float(os.getenv("WEAVIATE_TIMEOUT_S", "20"))
+HTTP_POOL_TIMEOUT_S = float(os.getenv("HTTP_POOL_TIMEOUT_S", "1"))
 
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        r = await client.get(f"{WEAVIATE_BASE}/v1/schema", headers=_headers())
-        r.raise_for_status()
-        classes = [c.get("class") for c in (r.json().get("classes", []) or [])]
-        if "LabDoc" in classes:
-            return
+# Applied per request on the shared Weaviate client for retrieval queries.
+_WV_TIMEOUT = httpx.Timeout(connect=1.0, read=WEAVIATE_TIMEOUT_S, write=2.0, pool=HTTP_POOL_TIMEOUT_S)
 
-        # Weaviate accepts POST /v1/schema with {"class": "..."}
-        cr = await client.post(f"{WEAVIATE_BASE}/v1/schema", json=schema, headers=_headers())
-        cr.raise_for_status()
+# Request bodies are encoded with orjson and sent as raw content, so the JSON
+# content type is set once per client.
+_JSON = {"Content-Type": "application/json"}
 
 # -----------------------------
 # Ollama config
 # -----------------------------
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://ollama:11434").rstrip("/")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:1b")
+# Generous read timeout: the first request after startup includes model load.
+OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT_S", "120"))
+
+_OLLAMA = httpx.AsyncClient(
+    base_url=OLLAMA_BASE_URL,
+    headers=_JSON,
+    timeout=httpx.Timeout(connect=2.0, read=OLLAMA_TIMEOUT_S, write=5.0, pool=HTTP_POOL_TIMEOUT_S),
+    limits=_LIMITS,
+)
+
+# -----------------------------
+# Query embeddings
+# -----------------------------
+# LabDoc is vectorized by the text2vec-transformers container, so query
+# embeddings come from the same model to stay in the same vector space.
+TRANSFORMERS_INFERENCE_API = os.getenv(
+    "TRANSFORMERS_INFERENCE_API", "http://text2vec-transformers:8080"
+).rstrip("/")
+
+_T2V = httpx.AsyncClient(
+    base_url=TRANSFORMERS_INFERENCE_API,
+    headers=_JSON,
+    timeout=httpx.Timeout(connect=1.0, read=10.0, write=2.0, pool=HTTP_POOL_TIMEOUT_S),
+    limits=_LIMITS,
+)
+
+async def aclose() -> None:
+    """Close the shared Ollama/transformers clients (called on app shutdown)."""
+    await _OLLAMA.aclose()
+    await _T2V.aclose()
+
+# Exact-text cache so a repeated question costs a dict hit, not a forward pass.
+# The model is uncased, so keys ignore case and whitespace differences.
+_EMB_CACHE = TTLCache(max_size=int(os.getenv("EMBED_CACHE_MAX", "1024")))
+
+def _embed_key(query: str) -> bytes:
+    return hashlib.sha256(" ".join(query.split()).casefold().encode()).digest()
+
+def embed_cache_stats() -> dict:
+    return _EMB_CACHE.stats()
+
+async def embed_query(query: str) -> List[float]:
+    """Embed a query with the same model Weaviate uses for LabDoc (cached)."""
+    key = _embed_key(query)
+    vec = _EMB_CACHE.get(key)
+    if vec is not None:
+        return vec
+
+    r = await _T2V.post("/vectors", content=orjson.dumps({"text": query}))
+    r.raise_for_status()
+    vec = orjson.loads(r.content)["vector"]
+    _EMB_CACHE.put(key, vec)
+    return vec
+
+# Fixed context window. Ollama reloads the model whenever num_ctx changes, so
+# this is a constant sized for MAX_CONTEXT_TOKENS of sources plus the prompt
+# scaffold, the question, and num_predict — not recomputed per request.
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+
+OLLAMA_OPTIONS = {
+    # Hard cap output length; tune as needed
+    "num_predict": 120,
+    "temperature": 0.2,
+    "num_ctx": OLLAMA_NUM_CTX,
+}
+
+# Exact-prompt cache of generations. The prompt embeds the retrieved sources,
+# so new content produces a new key; clear_llm_cache() drops everything.
+_LLM_CACHE = TTLCache(
+    max_size=int(os.getenv("LLM_CACHE_MAX", "512")),
+    ttl_s=float(os.getenv("LLM_CACHE_TTL_S", "3600")),
+)
+
+# Model and options are fixed per process, so only the prompt varies per key.
+_LLM_KEY_SUFFIX = b"\0" + OLLAMA_MODEL.encode() + b"\0" + orjson.dumps(OLLAMA_OPTIONS, option=orjson.OPT_SORT_KEYS)
+
+def _llm_key(prompt: str) -> bytes:
+    return hashlib.sha256(prompt.encode() + _LLM_KEY_SUFFIX).digest()
+
+def clear_llm_cache() -> None:
+    _LLM_CACHE.clear()
+
+def llm_cache_stats() -> dict:
+    return _LLM_CACHE.stats()
+
+# Generations currently in flight, by cache key. A second caller with the
+# same prompt awaits the first caller's task instead of asking Ollama again.
+_INFLIGHT: Dict[bytes, "asyncio.Task[str]"] = {}
+
+async def _generate(prompt: str, key: bytes) -> str:
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": False,
+        "options": OLLAMA_OPTIONS,
+    }
+
+    r = await _OLLAMA.post("/api/generate", content=orjson.dumps(payload))
+    r.raise_for_status()
+    data = orjson.loads(r.content)
+    answer = (data.get("response") or "").strip()
+    _LLM_CACHE.put(key, answer)
+    return answer
+
+def _forget_inflight(key: bytes, task: "asyncio.Task[str]") -> None:
+    _INFLIGHT.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # mark retrieved even if every waiter gave up
 
 async def ollama_generate(prompt: str) -> str:
     """
     Generate an answer using Ollama.
     Uses non-streaming mode and caps tokens to keep answers short.
+    Identical (model, prompt, options) requests are served from _LLM_CACHE,
+    and concurrent identical requests share one upstream call. The call is
+    shielded, so a caller timing out doesn't cancel it for the others.
+    """
+    key = _llm_key(prompt)
+    answer = _LLM_CACHE.get(key)
+    if answer is not None:
+        return answer
+
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate(prompt, key))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda t: _forget_inflight(key, t))
+    return await asyncio.shield(task)
+
+# Match the Ollama server's OLLAMA_NUM_PARALLEL so fan-out fills its decode
+# slots without queueing extra requests behind them.
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+_OLLAMA_SEM = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+
+# Prompt-token bin edges for ollama_generate_many(). Output is capped by
+# num_predict, so prompt length (prefill) is what varies between requests.
+_LENGTH_BINS = (256, 512, 1024)
+
+def predict_tokens(prompt: str) -> int:
+    """Cheap per-prompt size estimate used for scheduling."""
+    return estimate_tokens(prompt)
+
+async def ollama_generate_many(prompts: List[str]) -> List[str]:
+    """
+    Generate answers for several prompts concurrently, at most
+    OLLAMA_NUM_PARALLEL at a time. Results are in the same order as prompts.
+    Prompts are dispatched by length bin, shortest first, so the requests
+    sharing Ollama's parallel slots at any moment are of similar size.
+    """
+    async def _one(prompt: str) -> str:
+        async with _OLLAMA_SEM:
+            return await ollama_generate(prompt)
+
+    # Stable sort keeps input order within a bin; the semaphore admits
+    # waiters FIFO, so task creation order is dispatch order.
+    order = sorted(range(len(prompts)), key=lambda i: bisect.bisect_left(_LENGTH_BINS, predict_tokens(prompts[i])))
+    answers = await asyncio.gather(*[_one(prompts[i]) for i in order])
+
+    results = [""] * len(prompts)
+    for i, answer in zip(order, answers):
+        results[i] = answer
+    return results
+
+async def ollama_stream(prompt: str) -> AsyncIterator[str]:
+    """
+    Stream an answer from Ollama, yielding text fragments as they are decoded.
+    Ollama sends one JSON object per line; the last one has "done": true.
     """
-    url = f"{OLLAMA_BASE_URL}/api/generate"
     payload = {
         "model": OLLAMA_MODEL,
         "prompt": prompt,
-        "stream": False,
-        "options": {
-            # Hard cap output length; tune as needed
-            "num_predict": 120,
-            "temperature": 0.2,
-        },
+        "stream": True,
+        "options": OLLAMA_OPTIONS,
     }
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        r = await client.post(url, json=payload)
+    async with _OLLAMA.stream("POST", "/api/generate", content=orjson.dumps(payload)) as r:
         r.raise_for_status()
-        data = r.json()
-        return (data.get("response") or "").strip()
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            data = orjson.loads(line)
+            if data.get("error"):
+                raise RuntimeError(f"Ollama error: {data['error']}")
+            token = data.get("response") or ""
+            if token:
+                yield token
+            if data.get("done"):
+                break
 
 # -----------------------------
 # RAG tuning
 # -----------------------------
 RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
-RAG_MAX_SOURCE_CHARS = int(os.getenv("RAG_MAX_SOURCE_CHARS", "1200"))
 
-async def retrieve_sources(query: str, k: Optional[int] = None) -> List[Dict[str, Any]]:
-    """
-    Retrieve top-k documents from Weaviate using nearText on LabDoc.
-    """
-    await ensure_schema()
+# Total token budget for source excerpts in one prompt. Prefill time grows with
+# prompt length, so lower-ranked sources are dropped/truncated past this.
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "1024"))
+# No tokenizer ships with the API image; ~4 chars/token is close for English.
+RAG_CHARS_PER_TOKEN = float(os.getenv("RAG_CHARS_PER_TOKEN", "4"))
 
-    k = k or RAG_TOP_K
-    safe_query = query.replace('"', '\\"')
-
-    gql = {
-        "query": (
-            "{\n"
-            "  Get {\n"
-            f'    LabDoc(limit: {k}, nearText: {{ concepts: ["{safe_query}"] }}) {{\n'
-            "      title\n"
-            "      url\n"
-            "      source\n"
-            "      published_date\n"
-            "      text\n"
-            "      _additional { distance }\n"
-            "    }\n"
-            "  }\n"
-            "}\n"
-        )
-    }
+# Semantic answer cache: near-duplicate questions (cosine >= tau) reuse the
+# previous answer + sources. SEMANTIC_CACHE_MAX=0 disables it.
+SEMANTIC_CACHE = SemanticCache(
+    max_size=int(os.getenv("SEMANTIC_CACHE_MAX", "256")),
+    ttl_s=float(os.getenv("SEMANTIC_CACHE_TTL_S", "600")),
+    tau=float(os.getenv("SEMANTIC_CACHE_TAU", "0.92")),
+)
 
-    async with httpx.AsyncClient(timeout=25.0) as client:
-        r = await client.post(f"{WEAVIATE_BASE}/v1/graphql", json=gql, headers=_headers())
-        r.raise_for_status()
-        docs = (r.json().get("data", {}) or {}).get("Get", {}).get("LabDoc", []) or []
+# Hybrid retrieval: run dense (nearVector) and keyword (BM25) searches in
+# parallel and merge them with Reciprocal Rank Fusion. RAG_HYBRID=false
+# falls back to dense only.
+RAG_HYBRID = os.getenv("RAG_HYBRID", "true").lower() in ("1", "true", "yes")
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
+# Exact-query cache of retrieval results, keyed by (normalized query, k).
+# Cleared on ingest via clear_retrieve_cache(). RAG_CACHE_MAX=0 disables it.
+_RETRIEVE_CACHE = TTLCache(
+    max_size=int(os.getenv("RAG_CACHE_MAX", "1024")),
+    ttl_s=float(os.getenv("RAG_CACHE_TTL", "300")),
+)
+
+def clear_retrieve_cache() -> None:
+    _RETRIEVE_CACHE.clear()
+
+def retrieve_cache_stats() -> dict:
+    return _RETRIEVE_CACHE.stats()
+
+_SOURCE_FIELDS = """
+      title
+      url
+      source
+      published_date
+      snippet
+      _additional { id distance }
+"""
+
+_NEAR_VECTOR_QUERY = """
+query LabDocNearVector($vector: [Float]!, $limit: Int) {
+  Get {
+    LabDoc(limit: $limit, nearVector: { vector: $vector }) {%s}
+  }
+}
+""" % _SOURCE_FIELDS
+
+_BM25_QUERY = """
+query LabDocBM25($query: String, $limit: Int) {
+  Get {
+    LabDoc(limit: $limit, bm25: { query: $query }) {%s}
+  }
+}
+""" % _SOURCE_FIELDS
+
+def _display_date(value: Any) -> str:
+    """published_date is stored as epoch seconds; show it as YYYY-MM-DD."""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc).date().isoformat()
+    return value or ""
+
+async def _get_sources(query: str, variables: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Run a LabDoc Get query and shape the hits into source dicts."""
+    # Inputs travel as GraphQL variables, never spliced into the query string.
+    r = await _WV.post(
+        "/v1/graphql",
+        content=orjson.dumps({"query": query, "variables": variables}),
+        timeout=_WV_TIMEOUT,
+    )
+    r.raise_for_status()
+    body = orjson.loads(r.content)
+    if body.get("errors"):
+        raise RuntimeError(f"Weaviate GraphQL error: {body['errors']}")
+    docs = (body.get("data", {}) or {}).get("Get", {}).get("LabDoc", []) or []
 
     sources: List[Dict[str, Any]] = []
     for d in docs:
-        full_text = d.get("text") or ""
+        additional = d.get("_additional", {}) or {}
         sources.append(
             {
+                "id": additional.get("id"),
                 "title": d.get("title") or "",
                 "url": d.get("url") or "",
                 "source": d.get("source") or "",
-                "published_date": d.get("published_date") or "",
-                "distance": (d.get("_additional", {}) or {}).get("distance"),
-                "snippet": full_text[:RAG_MAX_SOURCE_CHARS],
+                "published_date": _display_date(d.get("published_date")),
+                "distance": additional.get("distance"),
+                "snippet": d.get("snippet") or "",
             }
         )
 
     return sources
 
-def build_prompt(user_question: str, sources: List[Dict[str, Any]]) -> str:
-    if not sources:
-        context = "No sources retrieved."
+async def retrieve_sources_dense(query: str, k: int, vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    if vector is None:
+        vector = await embed_query(query)
+    return await _get_sources(_NEAR_VECTOR_QUERY, {"vector": vector, "limit": k})
+
+async def retrieve_sources_bm25(query: str, k: int) -> List[Dict[str, Any]]:
+    return await _get_sources(_BM25_QUERY, {"query": query, "limit": k})
+
+def rrf_merge(result_lists: List[List[Dict[str, Any]]], k: int) -> List[Dict[str, Any]]:
+    """
+    Reciprocal Rank Fusion: score(doc) = sum over lists of 1 / (RAG_RRF_K + rank).
+    The first list wins when a doc appears in several (dense keeps its distance).
+    """
+    scores: Dict[Any, float] = {}
+    docs: Dict[Any, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc.get("id") or doc.get("url")
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RAG_RRF_K + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ranked[:k]]
+
+async def _timed(coro, timings: Optional[Dict[str, int]], name: str):
+    t0 = time.monotonic_ns()
+    try:
+        return await coro
+    finally:
+        if timings is not None:
+            timings[name] = (time.monotonic_ns() - t0) // 1_000_000
+
+async def retrieve_sources(
+    query: str,
+    k: Optional[int] = None,
+    vector: Optional[List[float]] = None,
+    timings: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Retrieve top-k LabDoc sources.
+    Dense search uses nearVector (the query is embedded via embed_query()
+    unless a vector is passed in). With RAG_HYBRID, a BM25 search runs
+    concurrently and the two rankings are fused with RRF, so wall time is
+    the slower of the two rather than their sum. If a timings dict is
+    passed, per-branch milliseconds are recorded in it (nothing is recorded
+    when the result comes from the retrieve cache).
+    """
+    k = k or RAG_TOP_K
+    key = (query.strip().casefold(), k)
+    sources = _RETRIEVE_CACHE.get(key)
+    if sources is not None:
+        return sources
+
+    await ensure_schema()
+
+    if not RAG_HYBRID:
+        sources = await _timed(retrieve_sources_dense(query, k, vector), timings, "dense")
     else:
-        blocks = []
-        for i, s in enumerate(sources, start=1):
-            blocks.append(
-                f"""[Source {i}]
-Title: {s.get('title')}
-URL: {s.get('url')}
-Publisher: {s.get('source')} | Date: {s.get('published_date')}
-Excerpt:
-{s.get('snippet')}
-"""
-            )
-        context = "\n\n".join(blocks)
+        dense, bm25 = await asyncio.gather(
+            _timed(retrieve_sources_dense(query, k, vector), timings, "dense"),
+            _timed(retrieve_sources_bm25(query, k), timings, "bm25"),
+        )
+        sources = rrf_merge([dense, bm25], k)
+
+    _RETRIEVE_CACHE.put(key, sources)
+    return sources
 
-    return f"""You are a helpful assistant answering questions using ONLY the provided sources.
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / RAG_CHARS_PER_TOKEN)
+
+def pack_sources(
+    sources: List[Dict[str, Any]],
+    budget: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Keep sources (already ranked best-first) until their excerpts use up the
+    token budget; the last one that doesn't fit is truncated to the remainder.
+    Returns (packed_sources, tokens_left).
+    """
+    remaining = MAX_CONTEXT_TOKENS if budget is None else budget
+    packed: List[Dict[str, Any]] = []
+    for s in sources:
+        if remaining <= 0:
+            break
+        snippet = s.get("snippet") or ""
+        cost = estimate_tokens(snippet)
+        if cost > remaining:
+            s = {**s, "snippet": snippet[: int(remaining * RAG_CHARS_PER_TOKEN)]}
+            cost = remaining
+        packed.append(s)
+        remaining -= cost
+    return packed, remaining
+
+_SOURCE_TMPL = (
+    "[Source {i}]\n"
+    "Title: {title}\n"
+    "URL: {url}\n"
+    "Publisher: {source} | Date: {published_date}\n"
+    "Excerpt:\n"
+    "{snippet}\n"
+).format
+
+_PROMPT_TMPL = """You are a helpful assistant answering questions using ONLY the provided sources.
 If the sources are insufficient, say that clearly and suggest what information to add.
 
 User question:
-{user_question}
+{question}
 
 Sources:
 {context}
@@ -162,3 +443,13 @@ Instructions:
 - Use plain language.
 - At the end, list which sources you used (example: "Used sources: 1, 3").
 """
+
+def build_prompt(user_question: str, sources: List[Dict[str, Any]]) -> str:
+    if not sources:
+        context = "No sources retrieved."
+    else:
+        # Source dicts from _get_sources() always carry every template field;
+        # extra keys (id, distance) are ignored by str.format.
+        context = "\n\n".join(_SOURCE_TMPL(i=i, **s) for i, s in enumerate(sources, start=1))
+
+    return _PROMPT_TMPL.format_map({"question": user_question, "context": context})
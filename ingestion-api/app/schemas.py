@@ -1,13 +1,46 @@
-from pydantic import BaseModel, Field, HttpUrl
+from datetime import datetime, timezone
+from typing import Annotated
+
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, field_validator
+
+# 2100-01-01T00:00:00Z, the latest publish time we accept.
+MAX_PUBLISHED_EPOCH = 4102444800
+
+# A plain pattern check instead of HttpUrl: we only store and display the URL,
+# so the full parser (IDNA, IP hosts, normalization) isn't needed per doc.
+Url = Annotated[str, StringConstraints(pattern=r"^https?://[^\s]{1,2000}$")]
 
 class ArticleIn(BaseModel):
     """A simple, beginner-friendly schema for documents we want to store."""
 
-    title: str = Field(min_length=3, max_length=200)
-    url: HttpUrl
-    source: str = Field(min_length=2, max_length=80)
-    published_date: str = Field(min_length=8, max_length=30)
-    text: str = Field(min_length=50, max_length=20000)
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    title: Annotated[str, StringConstraints(min_length=3, max_length=200)]
+    url: Url
+    source: Annotated[str, StringConstraints(min_length=2, max_length=80)]
+    # Stored as unix epoch seconds. ISO dates like "2026-02-13" (or full
+    # datetimes) are converted on the way in, so existing data still loads.
+    published_date: int = Field(ge=0, le=MAX_PUBLISHED_EPOCH)
+    text: Annotated[str, StringConstraints(min_length=50, max_length=20000)]
+
+    @field_validator("published_date", mode="before")
+    @classmethod
+    def parse_published_date(cls, v):
+        if isinstance(v, bool):
+            raise ValueError("published_date must be an ISO date (YYYY-MM-DD) or unix epoch seconds")
+        if isinstance(v, str):
+            v = v.strip()
+            # ISO first, so compact dates like "20260213" aren't read as epoch.
+            try:
+                dt = datetime.fromisoformat(v)
+            except ValueError:
+                if v.isdigit():
+                    return int(v)
+                raise ValueError("published_date must be an ISO date (YYYY-MM-DD) or unix epoch seconds")
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return int(dt.timestamp())
+        return v
 
 class ChatIn(BaseModel):
     message: str = Field(min_length=2, max_length=2000)
@@ -1,5 +1,9 @@
 import os
+import asyncio
+import logging
 import httpx
+import orjson
+from typing import Optional, Tuple
 
 WEAVIATE_SCHEME = os.getenv("WEAVIATE_SCHEME", "http")
 WEAVIATE_HOST = os.getenv("WEAVIATE_HOST", "weaviate")
@@ -8,55 +12,252 @@ WEAVIATE_BASE = f"{WEAVIATE_SCHEME}://{WEAVIATE_HOST}:{WEAVIATE_PORT}"
 
 WEAVIATE_API_KEY = os.getenv("WEAVIATE_API_KEY", "")
 
-def _headers():
-    if WEAVIATE_API_KEY:
-        return {"Authorization": f"Bearer {WEAVIATE_API_KEY}"}
-    return {}
+# Batch import tuning: objects per /v1/batch/objects request, and how many of
+# those requests may be in flight at once.
+WV_BATCH_SIZE = int(os.getenv("WV_BATCH_SIZE", "100"))
+WV_BATCH_CONCURRENCY = int(os.getenv("WV_BATCH_CONCURRENCY", "4"))
+# Single-doc inserts are queued and sent together: a batch goes out once
+# WV_BATCH_SIZE docs are waiting or this long after the first one arrived.
+WV_FLUSH_INTERVAL_S = float(os.getenv("WV_FLUSH_INTERVAL_S", "0.05"))
+
+# Excerpt length stored with each doc as `snippet`, so retrieval reads this
+# instead of pulling the full text. Changing it only affects new ingests.
+RAG_MAX_SOURCE_CHARS = int(os.getenv("RAG_MAX_SOURCE_CHARS", "1200"))
+
+logger = logging.getLogger("ingestion-api")
+
+# The key never changes at runtime, so the auth header is built once.
+HEADERS = {"Authorization": f"Bearer {WEAVIATE_API_KEY}"} if WEAVIATE_API_KEY else {}
+
+# The one shared keep-alive client for Weaviate, also used by rag.py; closed
+# on app shutdown via aclose(). Callers pass per-request timeouts where their
+# budget differs from the default.
+# Bodies are orjson-encoded and sent as raw content, hence the content type.
+client = httpx.AsyncClient(
+    base_url=WEAVIATE_BASE,
+    headers={**HEADERS, "Content-Type": "application/json"},
+    timeout=httpx.Timeout(20.0, connect=5.0),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0),
+)
+
+async def aclose() -> None:
+    if _flusher is not None:
+        _flusher.cancel()
+    await client.aclose()
 
 async def ready() -> bool:
-    async with httpx.AsyncClient(timeout=5) as client:
-        r = await client.get(f"{WEAVIATE_BASE}/v1/.well-known/ready", headers=_headers())
-        return r.status_code == 200
+    r = await client.get("/v1/.well-known/ready", timeout=5)
+    return r.status_code == 200
+
+# Set once the LabDoc class is known to exist, so ensure_schema() only talks
+# to Weaviate on the first call in each process. The lock makes concurrent
+# first callers wait for that check instead of all issuing it.
+_schema_ready = False
+_schema_lock = asyncio.Lock()
 
 async def ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+    async with _schema_lock:
+        if not _schema_ready:
+            await _create_schema()
+            _schema_ready = True
+
+_NOT_INDEXED = {"indexFilterable": False, "indexSearchable": False}
+
+# Derived from `text`, so it must not change the vector or the BM25 index.
+_SNIPPET_PROPERTY = {
+    "name": "snippet",
+    "dataType": ["text"],
+    **_NOT_INDEXED,
+    "moduleConfig": {"text2vec-transformers": {"skip": True}},
+}
+
+async def _create_schema():
     schema = {
         "class": "LabDoc",
         "vectorizer": "text2vec-transformers",
+        # HNSW tuned for recall at small top-k. ef is fixed (the dynamic
+        # ef range only applies when ef=-1). distance, efConstruction and
+        # maxConnections are fixed once the class exists.
+        "vectorIndexType": "hnsw",
+        "vectorIndexConfig": {
+            "distance": "cosine",
+            "efConstruction": 128,
+            "maxConnections": 32,
+            "ef": 64,
+        },
+        # Null-state and property-length indexes are unused (no is-null or
+        # length filters); pinned off so they stay that way.
+        "invertedIndexConfig": {
+            "indexNullState": False,
+            "indexPropertyLength": False,
+        },
         "properties": [
+            # title and text feed BM25 in hybrid retrieval; url and source
+            # are display-only, so skip building inverted indexes for them.
+            # published_date is epoch seconds, kept filterable for ranges.
             {"name": "title", "dataType": ["text"]},
-            {"name": "url", "dataType": ["text"]},
-            {"name": "source", "dataType": ["text"]},
-            {"name": "published_date", "dataType": ["text"]},
+            {"name": "url", "dataType": ["text"], **_NOT_INDEXED},
+            {"name": "source", "dataType": ["text"], **_NOT_INDEXED},
+            {"name": "published_date", "dataType": ["int"]},
             {"name": "text", "dataType": ["text"]},
+            _SNIPPET_PROPERTY,
         ],
     }
 
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.get(f"{WEAVIATE_BASE}/v1/schema", headers=_headers())
+    # Fetch just this class (404 if missing) rather than every class in the
+    # schema; its properties are still needed for the migration checks below.
+    r = await client.get("/v1/schema/LabDoc", timeout=15)
+    if r.status_code != 404:
         r.raise_for_status()
-        classes = [c.get("class") for c in r.json().get("classes", [])]
-        if "LabDoc" in classes:
-            return
+        existing = orjson.loads(r.content)
+        props = {p.get("name"): p for p in existing.get("properties") or []}
+        if (props.get("published_date") or {}).get("dataType") not in (None, ["int"]):
+            # Data types can't be changed either, and int values won't insert.
+            logger.warning(
+                "LabDoc: published_date is %s from an older schema, so ingests will fail; "
+                "run bin/reset_all.sh, then bin/ingest_sample.sh",
+                props["published_date"].get("dataType"),
+            )
+        indexed = [
+            name for name in ("url", "source")
+            if name in props and (props[name].get("indexFilterable") or props[name].get("indexSearchable"))
+        ]
+        if indexed:
+            # Index flags can't be changed on an existing property.
+            logger.warning(
+                "LabDoc: %s still indexed from an older schema; to apply the current one, "
+                "run bin/reset_all.sh, then bin/ingest_sample.sh",
+                ", ".join(indexed),
+            )
+        if "snippet" not in props:
+            pr = await client.post("/v1/schema/LabDoc/properties", content=orjson.dumps(_SNIPPET_PROPERTY), timeout=15)
+            pr.raise_for_status()
+            logger.warning(
+                "LabDoc: added 'snippet' property; existing objects have empty excerpts "
+                "until re-ingested (bin/reset_all.sh, then bin/ingest_sample.sh)"
+            )
+        return
 
-        cr = await client.post(f"{WEAVIATE_BASE}/v1/schema", json=schema, headers=_headers())
-        cr.raise_for_status()
+    cr = await client.post("/v1/schema", content=orjson.dumps(schema), timeout=15)
+    cr.raise_for_status()
 
-async def insert_doc(doc: dict):
-    # Ensure Pydantic Url / datetime / etc become JSON-safe primitives
+def _lab_doc(doc) -> dict:
     if hasattr(doc, "model_dump"):
         doc = doc.model_dump(mode="json")
+    doc = doc or {}
+    text = doc.get("text")
+    snippet = text[:RAG_MAX_SOURCE_CHARS] if isinstance(text, str) else ""
+    return {"class": "LabDoc", "properties": {**doc, "snippet": snippet}}
 
-    # If a dict still contains Url objects, coerce anything non-primitive to str
-    safe_doc = {}
-    for k, v in (doc or {}).items():
-        if v is None or isinstance(v, (str, int, float, bool, list, dict)):
-            safe_doc[k] = v
-        else:
-            safe_doc[k] = str(v)
+async def _post_batch(docs: list) -> list:
+    payload = {"objects": [_lab_doc(d) for d in docs]}
+    # default=str turns any leftover non-JSON value (Url, datetime, ...) into
+    # a string during encoding, instead of a per-field pass beforehand.
+    r = await client.post("/v1/batch/objects", content=orjson.dumps(payload, default=str), timeout=90)
+    r.raise_for_status()
+    return orjson.loads(r.content)
 
-    payload = {"class": "LabDoc", "properties": safe_doc}
+def _object_errors(obj: dict) -> list:
+    return [err.get("message") for err in ((obj.get("result") or {}).get("errors") or {}).get("error") or []]
 
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.post(f"{WEAVIATE_BASE}/v1/objects", json=payload, headers=_headers())
-        r.raise_for_status()
-        return r.json()
+_insert_queue: "asyncio.Queue[Tuple[dict, asyncio.Future]]" = asyncio.Queue()
+_flusher: Optional["asyncio.Task[None]"] = None
+
+async def _flush_inserts() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _insert_queue.get()]
+        deadline = loop.time() + WV_FLUSH_INTERVAL_S
+        while len(batch) < WV_BATCH_SIZE:
+            try:
+                batch.append(await asyncio.wait_for(_insert_queue.get(), deadline - loop.time()))
+            except asyncio.TimeoutError:
+                break
+
+        # Drop docs whose caller already gave up (its /ingest got a 504), so
+        # a client retry doesn't end up inserting the doc twice.
+        batch = [(doc, fut) for doc, fut in batch if not fut.done()]
+        if not batch:
+            continue
+
+        failure: Optional[BaseException] = None
+        try:
+            results = await _post_batch([doc for doc, _ in batch])
+            if not isinstance(results, list) or len(results) != len(batch):
+                raise RuntimeError(f"Unexpected Weaviate batch response: {str(results)[:200]}")
+            for (_, fut), obj in zip(batch, results):
+                if fut.done():  # caller timed out while the batch was in flight
+                    continue
+                errors = _object_errors(obj)
+                if errors:
+                    fut.set_exception(RuntimeError("; ".join(errors)))
+                else:
+                    fut.set_result(obj)
+        except Exception as e:
+            failure = e
+        finally:
+            # Whatever went wrong (including cancellation at shutdown), no
+            # caller is left waiting on a future nobody will resolve.
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(failure or RuntimeError("Batch insert did not complete."))
+
+async def insert_doc(doc: dict):
+    """
+    Insert one document. It is queued and sent with any other inserts that
+    arrive within WV_FLUSH_INTERVAL_S as one /v1/batch/objects request;
+    returns the object's entry from the batch response.
+    """
+    global _flusher
+    if _flusher is None or _flusher.done():
+        _flusher = asyncio.ensure_future(_flush_inserts())
+
+    fut = asyncio.get_running_loop().create_future()
+    _insert_queue.put_nowait((doc, fut))
+    return await fut
+
+async def insert_docs(docs: list) -> dict:
+    """
+    Insert many documents via Weaviate's batch endpoint.
+    Docs are sent WV_BATCH_SIZE at a time with up to WV_BATCH_CONCURRENCY
+    requests in flight, so the vectorizer sees whole batches instead of one
+    object per HTTP call. Failed objects and failed batches are counted in
+    "failed" (their messages in "errors"), not raised, so a partial import
+    still reports what was written. Raises only if nothing was inserted
+    because every batch request failed.
+    """
+    batches = [docs[i:i + WV_BATCH_SIZE] for i in range(0, len(docs), WV_BATCH_SIZE)]
+    sem = asyncio.Semaphore(WV_BATCH_CONCURRENCY)
+
+    async def _send(batch: list) -> Tuple[int, list]:
+        """Returns (failed objects, error messages) for one batch."""
+        async with sem:
+            results = await _post_batch(batch)
+        failed, messages = 0, []
+        for obj in results:
+            errors = _object_errors(obj)
+            if errors:
+                # One object can come back with several messages.
+                failed += 1
+                messages.extend(errors)
+        return failed, messages
+
+    outcomes = await asyncio.gather(*[_send(b) for b in batches], return_exceptions=True)
+
+    failed, errors, first_exc = 0, [], None
+    for batch, outcome in zip(batches, outcomes):
+        if isinstance(outcome, BaseException):
+            failed += len(batch)
+            errors.append(f"batch of {len(batch)} failed: {type(outcome).__name__}: {outcome}")
+            first_exc = first_exc or outcome
+        else:
+            failed += outcome[0]
+            errors.extend(outcome[1])
+
+    inserted = len(docs) - failed
+    if inserted == 0 and first_exc is not None:
+        raise first_exc
+    return {"inserted": inserted, "failed": failed, "errors": errors}
@@ -214,5 +214,12 @@ async def main() -> None:
 
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    # Same event loop the API runs on (uvicorn --loop uvloop); plain asyncio
+    # if uvloop isn't installed, e.g. when run outside the container.
+    try:
+        import uvloop
+    except ImportError:
+        import asyncio
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
@@ -1,3 +1,4 @@
+import hmac
 import os
 from fastapi import APIRouter, HTTPException, Request
 from .schemas import MemoryQueryIn, MemoryQueryOut, MemoryHealthOut
@@ -14,7 +15,7 @@ def require_api_key(request: Request):
     incoming = request.headers.get("X-API-Key", "")
     if not incoming:
         raise HTTPException(status_code=401, detail="Missing X-API-Key header.")
-    if incoming != EDGE_API_KEY:
+    if not hmac.compare_digest(incoming.encode(), EDGE_API_KEY.encode()):
         raise HTTPException(status_code=403, detail="Invalid API key.")
 
 
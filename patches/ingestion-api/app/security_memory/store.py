@@ -30,6 +30,30 @@ def _weaviate_headers() -> dict:
     return {}
 
 
+# nearVector query with the vector and limit passed as GraphQL variables, so
+# the 768-float vector isn't serialized into the query text on every call.
+# The %s slot takes the optional tag filter.
+_NEAR_VECTOR_QUERY = """
+query SecurityMemoryNearVector($vector: [Float]!, $limit: Int) {
+  Get {
+    %s(
+      nearVector: { vector: $vector }
+      limit: $limit
+      %%s
+    ) {
+      text
+      title
+      source
+      tags
+      chunk_index
+      doc_path
+      _additional { distance }
+    }
+  }
+}
+""" % SECURITY_CLASS
+
+
 async def _embed(texts: List[str]) -> List[List[float]]:
     """Embed a list of texts using Ollama. Returns one vector per text."""
     async with httpx.AsyncClient(timeout=180.0) as client:
@@ -118,41 +142,22 @@ async def query_memory(payload: MemoryQueryIn) -> MemoryQueryOut:
     # Embed the query via Ollama
     qvec = (await _embed([payload.query]))[0]
 
-    # Build Weaviate GraphQL nearVector query
-    # Tags filter: match objects where tags array contains ANY of the requested tags
+    # Tags filter: match objects where tags array contains ANY of the requested tags.
+    # Tags are written as JSON string literals so quotes in them can't break the query.
     where_clause = ""
     if payload.tags:
-        # Weaviate OR filter: one operand per tag using containsAny on text[]
         tag_filters = ", ".join(
-            f'{{ path: ["tags"], operator: Equal, valueText: "{t}" }}'
+            f'{{ path: ["tags"], operator: Equal, valueText: {json.dumps(t)} }}'
             for t in payload.tags
         )
         where_clause = f"where: {{ operator: Or, operands: [{tag_filters}] }}"
 
-    graphql_query = f"""
-    {{
-      Get {{
-        {SECURITY_CLASS}(
-          nearVector: {{ vector: {json.dumps(qvec)} }}
-          limit: {top_k}
-          {where_clause}
-        ) {{
-          text
-          title
-          source
-          tags
-          chunk_index
-          doc_path
-          _additional {{ distance }}
-        }}
-      }}
-    }}
-    """
+    variables = {"vector": qvec, "limit": top_k}
 
     async with httpx.AsyncClient(timeout=25.0) as client:
         r = await client.post(
             f"{WEAVIATE_URL}/v1/graphql",
-            json={"query": graphql_query},
+            json={"query": _NEAR_VECTOR_QUERY % where_clause, "variables": variables},
             headers=_weaviate_headers(),
         )
         r.raise_for_status()